@@ -1,10 +1,11 @@
 import concurrent.futures
 import functools
+import inspect
 import os
-import re
-import statistics
+import random
 import threading
-from datetime import datetime, timedelta
+import traceback
+from datetime import datetime, timezone
 
 import numpy as np
 import pandas as pd
@@ -35,62 +36,98 @@ class Timer:
         self.minutes_taken = self.seconds_taken / 60
 
 
-def is_running_locally(env_key: str = 'IS_RUNNING_IN_DOCKER'):
+@functools.lru_cache(maxsize=None)
+def is_running_locally(env_key: str = 'IS_RUNNING_IN_DOCKER') -> bool:
     """
     Checks whether the code is running locally
     For docker containers, set the environment variable IS_RUNNING_IN_DOCKER to 'true' in Dockerfile.
     ENV IS_RUNNING_IN_DOCKER true
+    The result is cached per env_key, call `is_running_locally.cache_clear()` after changing the variable at runtime.
     """
-    return not os.getenv(env_key, False) == 'true'
+    return os.getenv(env_key, 'false').lower() != 'true'
 
 
-def retry_with_timeout(retries=3, timeout=60, initial_delay=10, backoff=2):
+def retry_with_timeout(retries=3, timeout=60, initial_delay=10, backoff=2, max_delay=None, jitter=0.5,
+                       wait_for_timed_out_attempt=False):
     """
     A decorator for retrying a function if it doesn't complete within 'timeout' seconds or if it raises an error.
 
+    Each attempt runs in its own worker thread, so the timeout starts when the attempt starts, and a timed-out
+    attempt is left running in the background while the decorator moves on to the next retry.
+
     !Note!: This decorator cannot cancel ongoing blocking operations (e.g., network I/O with `requests`).
     It is recommended to implement timeouts directly within the function, e.g., `requests.get(url, timeout=seconds)`,
     for more effective timeout handling.
+    Because a timed-out attempt may still be running when the next one starts, retried functions must not share
+    non-thread-safe resources (e.g. a database connection) between attempts, unless `wait_for_timed_out_attempt`
+    is set. Functions that want to stop early can accept a `_cancel_event` keyword argument: a `threading.Event`
+    is passed in (unless the caller provides one) and set when the attempt times out, so the function can check
+    `_cancel_event.is_set()` and return.
 
     :param retries: The number of retries.
     :param timeout: The function timeout in seconds.
     :param initial_delay: The initial wait between retries.
     :param backoff: The backoff multiplier for the delay.
+    :param max_delay: The upper bound for the backoff delay in seconds, no bound if None.
+    :param jitter: The maximum random fraction added to each delay after capping it with max_delay,
+                   e.g. 0.5 makes a 10s delay anywhere in 10-15s, so concurrent callers don't retry in lockstep.
+    :param wait_for_timed_out_attempt: Wait for a timed-out attempt to finish before retrying, so attempts never
+                                       overlap. Use it when attempts share a resource that isn't thread-safe.
     """
 
     def decorator(func):
+        try:
+            accepts_cancel_event = '_cancel_event' in inspect.signature(func).parameters
+        except (TypeError, ValueError):
+            # Some builtins and C extensions don't expose a signature
+            accepts_cancel_event = False
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             attempts = 0
-            current_delay = initial_delay
+            base_delay = initial_delay
             last_exception = None
 
             while attempts < retries:
                 attempts_left = retries - attempts - 1
-                with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-                    future = executor.submit(func, *args, **kwargs)
-                    try:
-                        return future.result(timeout=timeout)
-                    except concurrent.futures.TimeoutError:
-                        future.cancel()
-                        msg = f"Function {func.__name__} timed out after {timeout}s"
-                        if attempts_left > 0:
-                            msg += f", {attempts_left} attempts left, delay: {current_delay}s..."
-                        else:
-                            msg += f", no attempts left, raising exception..."
-                        print(msg)
-                    except Exception as e:
-                        last_exception = e
-                        msg = f"Function {func.__name__} raised an exception: {e}"
-                        if attempts_left > 0:
-                            msg += f", {attempts_left} attempts left, delay: {current_delay}s..."
-                        else:
-                            msg += f", no attempts left, raising exception..."
-                        print(msg)
+                if max_delay is not None:
+                    base_delay = min(max_delay, base_delay)
+                current_delay = round(base_delay * (1 + random.uniform(0, jitter)), 2)
+                cancel_event = None
+                attempt_kwargs = kwargs
+                if accepts_cancel_event and '_cancel_event' not in kwargs:
+                    cancel_event = threading.Event()
+                    attempt_kwargs = {**kwargs, '_cancel_event': cancel_event}
+                executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="retry")
+                future = executor.submit(func, *args, **attempt_kwargs)
+                try:
+                    return future.result(timeout=timeout)
+                except concurrent.futures.TimeoutError:
+                    if cancel_event is not None:
+                        cancel_event.set()
+                    if wait_for_timed_out_attempt:
+                        concurrent.futures.wait([future])
+                    msg = f"Function {func.__name__} timed out after {timeout}s"
+                    if attempts_left > 0:
+                        msg += f", {attempts_left} attempts left, delay: {current_delay}s..."
+                    else:
+                        msg += f", no attempts left, raising exception..."
+                    print(msg)
+                except Exception as e:
+                    last_exception = e
+                    msg = f"Function {func.__name__} raised an exception: {e}"
+                    if attempts_left > 0:
+                        msg += f", {attempts_left} attempts left, delay: {current_delay}s..."
+                    else:
+                        msg += f", no attempts left, raising exception..."
+                    print(msg)
+                finally:
+                    # Don't block on a timed-out attempt, its thread exits once the function returns
+                    executor.shutdown(wait=False)
 
                 if attempts < retries - 1:
                     time.sleep(current_delay)
-                    current_delay *= backoff
+                    base_delay *= backoff
                 else:
                     break
 
@@ -105,14 +142,40 @@ def retry_with_timeout(retries=3, timeout=60, initial_delay=10, backoff=2):
 
 
 def valid_date(date):
-    if date:
-        date = str(date)
-        try:
-            x = datetime.strptime(date.strip(), "%d-%m-%Y").strftime("%Y-%m-%d")
-            return x
-        except ValueError:
-            return date.strip()
-    return np.nan
+    if not date:
+        return np.nan
+
+    date = str(date).strip()
+    # Skip strptime (and the ValueError it raises) for dates that are already in YYYY-MM-DD format
+    if len(date) == 10 and date[4] == '-' and date[7] == '-' and date[:4].isdigit():
+        return date
+    try:
+        return datetime.strptime(date, "%d-%m-%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return date
+
+
+def valid_date_array(dates: pd.Series) -> pd.Series:
+    """
+    Vectorized version of `valid_date` for a whole Series:
+    'DD-MM-YYYY' dates are converted to 'YYYY-MM-DD', other values are returned stripped.
+    Unlike `valid_date`, missing values (None, NaN, pd.NA) become NaN rather than the string 'nan',
+    and only missing values and blank strings are treated as empty (e.g. 0 is returned as '0').
+    """
+    stripped = dates.astype(str).str.strip()
+    converted = pd.to_datetime(stripped, format='%d-%m-%Y', errors='coerce').dt.strftime('%Y-%m-%d')
+    is_present = (dates.notna() & stripped.ne('')).fillna(False).astype(bool)
+    return converted.fillna(stripped).where(is_present, np.nan)
+
+
+def _largest_close_run(nums: np.ndarray, threshold: float) -> tuple[int, int]:
+    """
+    Find the longest run of a sorted array in which neighbouring nums differ by at most `threshold`.
+    :return: the start and end (exclusive) indexes of the run, the first one if several are equally long.
+    """
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(nums) > threshold) + 1, [len(nums)]))
+    longest = int(np.argmax(np.diff(bounds)))
+    return int(bounds[longest]), int(bounds[longest + 1])
 
 
 def get_closest_num_group(num_list: list[int], convert_nums_to_closest_100: bool = False) -> list:
@@ -130,37 +193,44 @@ def get_closest_num_group(num_list: list[int], convert_nums_to_closest_100: bool
     If the max num is more than 10000 and less than 2 times the min num, the function will return the list as is.
 
     The algorithm will calculate the median of the list and group the nums that are close to the median.
+
+    String nums (e.g. '12.5') are converted to integers, other nums keep their type, so floats are not truncated.
     """
 
-    # Convert any string elements in the list to integers
-    num_list = [int(float(num)) if isinstance(num, str) else num for num in num_list]
+    # Convert string elements (e.g. '12.5') to integers, in one pass if all elements are strings
+    nums = np.asarray(num_list)
+    if nums.dtype.kind in 'OSU':
+        if all(isinstance(num, str) for num in num_list):
+            nums = nums.astype(np.float64).astype(np.int64)
+        else:
+            # NumPy turns mixed strings and numbers into strings, so convert element by element to keep floats
+            nums = np.asarray([int(float(num)) if isinstance(num, str) else num for num in num_list])
 
-    # Convert numbers to the closest 100 if the flag is set
+    # Convert numbers to the closest 100 if the flag is set (np.round rounds halves to even, like round())
     if convert_nums_to_closest_100:
-        num_list = [round(num / 100) * 100 for num in num_list]
+        nums = (np.round(nums / 100) * 100).astype(np.int64)
 
     # Remove duplicates and sort the list
-    num_list = list(set(num_list))
-    num_list.sort()
+    nums = np.unique(nums)
 
     # If the list contains less than 4 numbers, return the list as is
-    if len(num_list) < 4:
-        return num_list
+    if len(nums) < 4:
+        return nums.tolist()
 
-    max_num = max(num_list)
-    min_num = min(num_list)
+    max_num = nums[-1]
+    min_num = nums[0]
 
     # Return the list as is if the max number is less than 10,000 and less than 3 times the min number
     # or if the max number is more than 10,000 and less than 2 times the min number
     if ((max_num < 10000) and (max_num <= 3 * min_num)) or ((max_num > 10000) and (max_num <= 2 * min_num)):
-        return num_list
+        return nums.tolist()
 
-    # Calculate the median of the list
-    median = statistics.median(num_list)
+    # Calculate the median of the list and the absolute differences from it
+    median = np.median(nums)
+    differences = np.abs(nums - median)
 
     # If the list is long enough, group numbers close to the median
-    if len(num_list) > 5:
-        diff = [abs(num - median) for num in num_list]  # Calculate the absolute differences from the median
+    if len(nums) > 5:
         threshold = 0.5  # Default threshold as 50% of the median
 
         # Increase the threshold if the range is very wide
@@ -168,49 +238,77 @@ def get_closest_num_group(num_list: list[int], convert_nums_to_closest_100: bool
             threshold = 0.6
 
         median_border = median * threshold  # Calculate the boundary for close numbers
-        close_group = [num_list[i] for i in range(len(num_list)) if diff[i] <= median_border]  # Group close numbers
+        close_group = nums[differences <= median_border]  # Group close numbers
 
         # If no close group is found, return the original list
-        if not close_group:
-            return num_list
-
-        return close_group
+        if not close_group.size:
+            return nums.tolist()
 
-    # Calculate the differences from the median
-    differences = [abs(num_list[i] - median) for i in range(len(num_list))]
+        return close_group.tolist()
 
-    threshold = statistics.median(differences)  # Use the median of differences as the threshold
+    threshold = np.median(differences)  # Use the median of differences as the threshold
 
     # Increase the threshold if the minimum number is large
     if min_num > 5000:
         threshold = 3 * threshold
 
     # If the differences are small, return the list as is
-    if threshold < 1000 and max(differences) < 1000:
-        return num_list
+    if threshold < 1000 and differences.max() < 1000:
+        return nums.tolist()
 
-    groups = []
-    current_group = [num_list[0]]
+    # Return the largest group of numbers that are within the threshold of each other
+    start, end = _largest_close_run(nums, threshold)
+
+    return nums[start:end].tolist()
+
+
+_BG_POOL_SIZE = int(os.getenv("BG_POOL_SIZE", "16"))
+_BG_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=_BG_POOL_SIZE, thread_name_prefix="bg")
+# Counts the idle pool workers, so a job is only submitted to the pool when it can start right away
+_BG_POOL_SLOTS = threading.BoundedSemaphore(_BG_POOL_SIZE)
+
+
+def _print_background_exception(future: concurrent.futures.Future) -> None:
+    # Futures keep exceptions to themselves; print them like an unhandled exception in a plain thread would be
+    if not future.cancelled() and future.exception() is not None:
+        traceback.print_exception(future.exception())
+
+
+def _run_in_pool_slot(job_func, args, kwargs):
+    try:
+        return job_func(*args, **kwargs)
+    finally:
+        _BG_POOL_SLOTS.release()
 
-    # Group numbers that are within the threshold
-    for i in range(1, len(num_list)):
-        if num_list[i] - num_list[i - 1] <= threshold:
-            current_group.append(num_list[i])
-        else:
-            groups.append(current_group)
-            current_group = [num_list[i]]
-    groups.append(current_group)
 
-    # Return the largest group
-    max_group = max(groups, key=len)
+def _run_into_future(future: concurrent.futures.Future, job_func, args, kwargs) -> None:
+    if not future.set_running_or_notify_cancel():
+        return
+    try:
+        future.set_result(job_func(*args, **kwargs))
+    except BaseException as e:
+        future.set_exception(e)
+
 
-    return max_group
+def run_threaded(job_func, *args, **kwargs) -> concurrent.futures.Future:
+    """
+    Run a function in a background thread, reusing a worker from a shared pool (size set by the BG_POOL_SIZE
+    environment variable, default 16) when one is idle. When all workers are busy (e.g. with long-running
+    scheduled jobs), the function gets a dedicated thread instead, so it always starts right away.
+    `run_func_in_background` is a deprecated alias of this function.
+    :return: the Future of the call, which can be used to wait for the result.
+    """
+    if _BG_POOL_SLOTS.acquire(blocking=False):
+        future = _BG_POOL.submit(_run_in_pool_slot, job_func, args, kwargs)
+    else:
+        future = concurrent.futures.Future()
+        threading.Thread(target=_run_into_future, args=(future, job_func, args, kwargs)).start()
+    future.add_done_callback(_print_background_exception)
+    return future
 
 
-def run_threaded(job_func, *args, **kwargs):
-    """Run a function in a separate thread"""
-    job_thread = threading.Thread(target=job_func, args=args, kwargs=kwargs)
-    job_thread.start()
+# Deprecated: kept for backwards compatibility, use `run_threaded` instead.
+run_func_in_background = run_threaded
 
 
 def generate_dates(start_date: str) -> list[str]:
@@ -218,16 +316,7 @@ def generate_dates(start_date: str) -> list[str]:
     Generate a list of dates from the start date to today
     :param start_date: The start date in the format 'YYYY-MM-DD'
     """
-    start_date = datetime.strptime(start_date, '%Y-%m-%d')
-    today = datetime.now()
-
-    dates = []
-    current_date = start_date
-    while current_date <= today:
-        dates.append(current_date.strftime('%Y-%m-%d'))
-        current_date += timedelta(days=1)
-
-    return dates
+    return pd.date_range(start=start_date, end=pd.Timestamp.today().normalize(), freq='D').strftime('%Y-%m-%d').tolist()
 
 
 def get_local_files_mapping(root_path: str = 'modules/ddl_files') -> dict[str, str]:
@@ -236,16 +325,35 @@ def get_local_files_mapping(root_path: str = 'modules/ddl_files') -> dict[str, s
     :return: a dictionary with the file name as the key and the full path as the value
     """
     file_mapping = {}
-    for dirpath, dirnames, filenames in os.walk(root_path):
-        for filename in filenames:
+
+    def scan(dirpath: str) -> None:
+        # os.scandir reuses the file type from the directory listing, avoiding a stat call per entry
+        try:
+            with os.scandir(dirpath) as entries:
+                entries = list(entries)
+        except OSError:
+            return
+
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
+                continue
+
+            filename = entry.name
             if filename in file_mapping:
                 # Handle potential name conflicts by appending the directory to the name.
                 # For example: directory1_filename.sql, directory2_filename.sql
                 directory = os.path.basename(dirpath)
-                unique_filename = f"{directory}_{filename}"
-                file_mapping[unique_filename] = os.path.join(dirpath, filename)
-            else:
-                file_mapping[filename] = os.path.join(dirpath, filename)
+                filename = f"{directory}_{filename}"
+            file_mapping[filename] = entry.path
+
+        # Files of a directory are mapped before its subdirectories, as with os.walk
+        for subdir in subdirs:
+            scan(subdir)
+
+    scan(root_path)
     return file_mapping
 
 
@@ -256,17 +364,10 @@ def get_sql_ddl_commands_from_file(file_name: str, ddl_files_paths: dict[str, st
     if file_name not in ddl_files_paths:
         raise ValueError(f"{file_name} not found in the directory!")
 
-    file_path = ddl_files_paths[file_name]
-    print(file_path)
-    sql_commands = []
-    with open(file_path, 'r') as sql_file:
-        for command in sql_file.read().split(';'):
-            command = command.strip()
-            if command in ('', '\n'):
-                continue
-            sql_commands.append(command + ';')
+    with open(ddl_files_paths[file_name], 'r', encoding='utf-8') as sql_file:
+        content = sql_file.read()
 
-    return sql_commands
+    return [command.strip() + ';' for command in content.split(';') if command.strip()]
 
 
 def is_numeric_value(value):
@@ -278,17 +379,11 @@ def is_numeric_value(value):
         return False
 
     value = str(value).strip()
+    if value[:1] == '-':
+        value = value[1:]
 
-    pattern = r"^-?\d*\.?\d*$"
-
-    if re.match(pattern, value):
-        return True
-    return False
-
-
-def run_func_in_background(task, *args, **kwargs):
-    """Run the provided function in a background thread."""
-    threading.Thread(target=task, args=args, kwargs=kwargs).start()
+    # Plain string checks are much cheaper than a regex match on this hot path (called per row by date_formatter)
+    return value.replace('.', '', 1).isdecimal()
 
 
 def date_formatter(date,
@@ -306,15 +401,31 @@ def date_formatter(date,
     :param is_mongo_id_object: If it's a MongoDB ObjectId.
     :param is_mongo_time_object: If it's a MongoDB ISO date string.
     :return: string in the desired format or None if invalid
+
+    Results for hashable inputs are cached, so a value that fails to parse is only reported (printed) the first time
+    it is seen.
     """
-    if not date or date in {pd.NaT, np.nan, 'nan', 'NaT', 'None'}:
+    if not date:
         return None
 
-    try:
-        if isinstance(date, datetime):
-            # If the date is a datetime object, format it to the desired output format.
-            return date.strftime(output_format)
+    if isinstance(date, dict):
+        # Dicts are unhashable, so they bypass the cache
+        return _format_date(date, input_format, output_format, is_event_time, is_mongo_id_object,
+                            is_mongo_time_object)
+
+    if date in {pd.NaT, np.nan, 'nan', 'NaT', 'None'} or (pd.api.types.is_scalar(date) and pd.isna(date)):
+        return None
 
+    if isinstance(date, datetime):
+        # If the date is a datetime object, format it to the desired output format.
+        return date.strftime(output_format)
+
+    return _cached_format_date(date, input_format, output_format, is_event_time, is_mongo_id_object,
+                               is_mongo_time_object)
+
+
+def _format_date(date, input_format, output_format, is_event_time, is_mongo_id_object, is_mongo_time_object):
+    try:
         if is_event_time:
             # Handle event time by removing 'GMT' and fractional seconds
             return datetime.strptime(date.replace('GMT', '').strip().split('.')[0], "%Y-%m-%d %H:%M:%S").strftime(
@@ -330,15 +441,19 @@ def date_formatter(date,
 
         if isinstance(date, dict):
             # Handle dictionaries that may contain timestamps (e.g., milliseconds or $date)
-            date = date.get('milliseconds') or date.get('$date', {}).get('$numberLong')
-            date = int(float(date))
+            timestamp = date.get('milliseconds')
+            if not timestamp:
+                inner_date = date.get('$date')
+                timestamp = inner_date.get('$numberLong') if isinstance(inner_date, dict) else None
+            date = int(float(timestamp))
 
         if is_numeric_value(date) and not input_format:
             # Handle numeric timestamps (milliseconds or seconds)
-            if len(str(date)) > 10:
-                date = str(date)[:10]  # Truncate to 10 digits if needed
             timestamp = int(float(date))
-            return datetime.utcfromtimestamp(timestamp).strftime(output_format)
+            while timestamp >= 10_000_000_000:
+                timestamp //= 1000  # Reduce milliseconds (or finer) to seconds
+            # Formatted as a naive UTC datetime, so %Z and %z stay empty as with the former utcfromtimestamp
+            return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None).strftime(output_format)
 
         if isinstance(date, str):
             if input_format:
@@ -352,3 +467,8 @@ def date_formatter(date,
         return None
 
     return None
+
+
+# Pipelines call date_formatter per row on a small set of distinct values (timestamps, ObjectIds),
+# so the parsing of hashable inputs is memoized.
+_cached_format_date = functools.lru_cache(maxsize=65536, typed=True)(_format_date)
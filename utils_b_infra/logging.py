@@ -1,6 +1,9 @@
 import hashlib
+import io
 import os
+import ssl
 import traceback
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
 import sys
@@ -9,35 +12,41 @@ from slack_sdk import WebClient as SlackWebClient
 
 class SlackApi:
     def __init__(self, project_name: str, slack_token: str, slack_channel_id: str):
-        self.client = SlackWebClient(slack_token)
+        # slack_sdk sends requests with urllib, which builds a new SSL context (and reloads the CA bundle)
+        # for every request unless one is provided
+        self.client = SlackWebClient(slack_token, ssl=ssl.create_default_context())
         self.project_name = project_name
         self.slack_channel_id = slack_channel_id
+        self.bot_username = f"{project_name.lower()}-logger"
+        self.pre_text_prefix = f"[{project_name}]: "
+        self.sender_kwargs = {"username": self.bot_username, "icon_emoji": ":robot_face:"}
 
     def post_message(self, message: str, error_text: str = None):
         """ Post ordinary messages as warning or error messages as danger """
-        attachments = {
-            "text": message,
-            "fallback": message,
-            "color": "warning"
-        }
-
         if error_text:
-            pre_text = f"[{self.project_name}]: {message}"
-            attachments.update({
+            pre_text = self.pre_text_prefix + message
+            attachment = {
                 "text": error_text,
                 "pretext": pre_text,
                 "fallback": pre_text,
                 "title": "Error traceback",
                 "color": "danger"
-            })
+            }
+        else:
+            attachment = {
+                "text": message,
+                "fallback": message,
+                "color": "warning"
+            }
 
         self.client.chat_postMessage(channel=self.slack_channel_id,
-                                     attachments=[attachments],
-                                     username=f"{self.project_name.lower()}-logger",
-                                     icon_emoji=":robot_face:")
+                                     attachments=(attachment,),
+                                     **self.sender_kwargs)
 
 
 class SlackLogger:
+    __slots__ = ('project_name', 'slacker', 'last_messages')
+
     def __init__(self, project_name: str, slack_token: str, slack_channel_id: str) -> None:
         self.project_name = project_name
         self.slacker = SlackApi(
@@ -45,27 +54,32 @@ class SlackLogger:
             slack_token=slack_token,
             slack_channel_id=slack_channel_id
         )
-        self.last_messages = []
+        self.last_messages: OrderedDict[str, datetime] = OrderedDict()  # error hash -> time posted, oldest first
 
     @staticmethod
     def hash_error(error_text):
-        return hashlib.md5(error_text.encode()).hexdigest()
-
-    def save_and_post_to_slack(self, error_text, message):
-        self.last_messages.append({
-            'date': datetime.now().replace(microsecond=0),
-            'message_hash': self.hash_error(error_text)
-        })
+        # Hashing is only used to deduplicate recent errors, so long texts are reduced to their first and last 1KB:
+        # the outer frames and the exception message (plus any additional data) at the end of the traceback
+        if len(error_text) > 2048:
+            error_text = error_text[:1024] + error_text[-1024:]
+        return hashlib.blake2b(error_text.encode('utf-8'), digest_size=16).hexdigest()
+
+    def save_and_post_to_slack(self, error_text, message, error_text_hash=None):
+        if error_text_hash is None:
+            error_text_hash = self.hash_error(error_text)
+        self.last_messages[error_text_hash] = datetime.now().replace(microsecond=0)
+        self.last_messages.move_to_end(error_text_hash)  # keep the entries ordered by time for pruning in error()
 
         truncated_error_text = error_text[-8000:] if len(error_text) > 8000 else error_text
         self.slacker.post_message(message=message, error_text=truncated_error_text)
-        # create logs directory if not exists
-        if not os.path.exists("logs"):
-            os.makedirs("logs")
-        with open(f"logs/{self.project_name}.log", "w", encoding='utf-8') as file:
-            file.write(f'\n \n DATE: {datetime.now().replace(microsecond=0)}: ERROR in {message} \n \n')
-            e_type, e_val, e_tb = sys.exc_info()
-            traceback.print_exception(e_type, e_val, e_tb, file=file)
+        # Build the entry in memory and append it with a single write
+        log_entry = io.StringIO()
+        log_entry.write(f'\n \n DATE: {datetime.now().replace(microsecond=0)}: ERROR in {message} \n \n')
+        e_type, e_val, e_tb = sys.exc_info()
+        traceback.print_exception(e_type, e_val, e_tb, file=log_entry)
+        os.makedirs("logs", exist_ok=True)
+        with open(f"logs/{self.project_name}.log", "ab") as file:
+            file.write(log_entry.getvalue().encode('utf-8'))
 
     def error(self, exc: Exception, header_message: str, error_additional_data=None) -> None:
         """
@@ -80,14 +94,13 @@ class SlackLogger:
         error_text_hash = self.hash_error(error_text)
 
         two_minutes_ago = datetime.now() - timedelta(minutes=2)
-        self.last_messages = [item for item in self.last_messages if item.get('date') > two_minutes_ago]
-
-        last_messages_hashes = [item.get('message_hash') for item in self.last_messages]
+        while self.last_messages and next(iter(self.last_messages.values())) <= two_minutes_ago:
+            self.last_messages.popitem(last=False)
 
-        if error_text_hash in last_messages_hashes:
+        if error_text_hash in self.last_messages:
             return
 
-        self.save_and_post_to_slack(error_text, header_message)
+        self.save_and_post_to_slack(error_text, header_message, error_text_hash=error_text_hash)
 
     def info(self, message: str) -> None:
         """
@@ -38,7 +38,8 @@ def clean_dataframe(df: pd.DataFrame, replace_pandas_nan=False, orders_dataframe
     return df
 
 
-@retry_with_timeout(retries=3, timeout=60, initial_delay=10, backoff=2)
+# Attempts share the connection, which isn't thread-safe, so a timed-out insert must finish before the retry
+@retry_with_timeout(retries=3, timeout=60, initial_delay=10, backoff=2, wait_for_timed_out_attempt=True)
 def insert_df_chunk_into_db(df: pd.DataFrame,
                             table_name: str,
                             conn: sqlalchemy.engine.Connection,